@@ -1,30 +1,436 @@
 import feedparser
 import json
+import orjson
 import os
 import base64
+import hashlib
+import itertools
 import re
+import sys
 import time
+import xml.etree.ElementTree as ET
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urljoin, urlparse
 from urllib.request import Request, urlopen
 
-# Helper to make feedparser entries JSON serializable
-def make_serializable(entry):
-    new_entry = {}
-    for key, value in entry.items():
-        if key.endswith('_parsed'):
-            continue # Skip struct_time fields
-        if isinstance(value, (str, int, float, bool, type(None))):
-            new_entry[key] = value
-        elif isinstance(value, list):
-             # Recursive simplistic check for lists (assuming list of dicts or primitives)
-             new_entry[key] = value # trusting it's simple enough or json.dump will fail and we catch it? 
-             # deep sanitization might be needed but let's try to keep it simple like the original script
-             # The original script seemingly worked with dict(entry), which is odd if it had struct_time.
-             # We'll skip keys with _parsed to be safe.
-        elif isinstance(value, dict):
-             new_entry[key] = value
-    return new_entry
+FEED_CACHE_FILE = 'feed_cache.json'
+FEED_CACHE_DIR = 'cache'
+BODY_CHUNK_SIZE = 64 * 1024
+
+_IMG_RE = re.compile(r'<img[^>]+src=["\']([^"\'>]+)["\']', re.IGNORECASE)
+
+_NS = {
+    'atom': 'http://www.w3.org/2005/Atom',
+    'rss1': 'http://purl.org/rss/1.0/',
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'content': 'http://purl.org/rss/1.0/modules/content/',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'media': 'http://search.yahoo.com/mrss/',
+}
+# Namespaces whose plain element names (title, link, ...) mean the same thing
+_CORE_NS = {'', _NS['atom'], _NS['rss1']}
+# Root elements the fast path understands; Atom 0.3 and RSS 0.90 go to feedparser
+_FEED_ROOTS = {('', 'rss'), (_NS['atom'], 'feed'), (_NS['rdf'], 'RDF')}
+# RSS and Atom element name -> article field
+_ENTRY_FIELDS = {
+    'title': 'title',
+    'description': 'summary',
+    'summary': 'summary',
+    'content': 'content',
+    'pubDate': 'published',
+    'published': 'published',
+    'updated': 'updated',
+    'guid': 'id',
+    'id': 'id',
+}
+
+def _split_tag(tag):
+    """Split an ElementTree '{namespace}name' tag into (namespace, name)."""
+    if tag[:1] == '{':
+        ns, _, name = tag[1:].partition('}')
+        return ns, name
+    return '', tag
+
+def _link_href(elem):
+    """Return the URL of an RSS <link> or an alternate Atom <link href>."""
+    href = elem.get('href')
+    if href is not None:
+        return href if elem.get('rel', 'alternate') == 'alternate' else ''
+    return (elem.text or '').strip()
+
+def _element_text(elem):
+    """Text of an element; for Atom type="xhtml" the markup inside it, without namespace prefixes."""
+    if elem.get('type') != 'xhtml':
+        return elem.text or ''
+    # Atom wraps xhtml content in a single <div>; emit what's inside it
+    container = elem[0] if len(elem) == 1 and _split_tag(elem[0].tag)[1] == 'div' else elem
+    for node in container.iter():
+        node.tag = _split_tag(node.tag)[1]
+    return (container.text or '') + ''.join(ET.tostring(node, encoding='unicode') for node in container)
+
+def _entry_from_element(item, base_url=''):
+    """
+    Pull the fields we keep out of an RSS <item> or Atom <entry> element.
+    
+    Relative links and image URLs are resolved against the entry link, falling
+    back to base_url (the feed's own link), as feedparser does.
+    """
+    fields = {}
+    media_content = media_thumbnail = enclosure = None
+    
+    for child in item:
+        ns, name = _split_tag(child.tag)
+        text = _element_text(child)
+        if ns in _CORE_NS:
+            if name == 'link':
+                if child.get('rel') == 'enclosure' and child.get('type', '').startswith('image/'):
+                    enclosure = enclosure or child.get('href')
+                elif not fields.get('link'):
+                    fields['link'] = _link_href(child)
+            elif name == 'enclosure':
+                if child.get('type', '').startswith('image/'):
+                    enclosure = enclosure or child.get('url')
+            elif name in _ENTRY_FIELDS:
+                fields.setdefault(_ENTRY_FIELDS[name], text.strip() if name != 'content' else text)
+        elif ns == _NS['content'] and name == 'encoded':
+            fields.setdefault('content', text)
+        elif ns == _NS['dc'] and name == 'date':
+            fields.setdefault('published', text.strip())
+    
+    # media:content / media:thumbnail may also sit inside a media:group
+    for elem in item.iter():
+        ns, name = _split_tag(elem.tag)
+        if ns == _NS['media'] and elem.get('url'):
+            if name == 'content' and media_content is None:
+                media_content = elem.get('url')
+            elif name == 'thumbnail' and media_thumbnail is None:
+                media_thumbnail = elem.get('url')
+    
+    link = fields.get('link', '')
+    if link and base_url:
+        link = urljoin(base_url, link)
+    content = fields.get('content', '')
+    summary = fields.get('summary', '') or content
+    
+    # Same precedence as the feedparser path: media:content, media:thumbnail,
+    # image enclosure, then the first <img> in the content/description
+    image_url = media_content or media_thumbnail or enclosure
+    if not image_url:
+        img_match = _IMG_RE.search(content or summary)
+        if img_match:
+            image_url = img_match.group(1)
+    if image_url and (link or base_url):
+        image_url = urljoin(link or base_url, image_url)
+    
+    return {
+        'title': fields.get('title') or 'No title',
+        'link': link,
+        'summary': summary,
+        'content': content,
+        'published': fields.get('published', ''),
+        'updated': fields.get('updated', ''),
+        'id': fields.get('id') or item.get(f'{{{_NS["rdf"]}}}about', ''),
+        'image_url': image_url
+    }
+
+def is_plain_feed(head):
+    """
+    Check from the start of the document whether parse_feed_fast can handle it.
+    
+    The head must parse as XML up to a root element in _FEED_ROOTS; an RDF
+    root also has to declare the RSS 1.0 namespace (RSS 0.90 uses its own).
+    Anything else, including a head expat rejects (e.g. an HTML entity such
+    as &nbsp;), is left to feedparser.
+    """
+    parser = ET.XMLPullParser(events=('start-ns', 'start'))
+    namespaces = set()
+    root = None
+    try:
+        parser.feed(head)
+        # Read every event: a syntax error is queued after the elements before it
+        for event, data in parser.read_events():
+            if event == 'start-ns':
+                namespaces.add(data[1])
+            elif root is None:
+                root = _split_tag(data.tag)
+    except ET.ParseError:
+        return False
+    if root == (_NS['rdf'], 'RDF'):
+        return _NS['rss1'] in namespaces
+    return root in _FEED_ROOTS
+
+def parse_feed_fast(chunks, limit, base_url=''):
+    """
+    Stream-parse an RSS 0.91+/1.0/2.0 or Atom 1.0 document from an iterable of bytes.
+    
+    Only the first `limit` entries are extracted and each element is dropped as
+    soon as it has been read. Relative URLs are resolved against the feed's
+    <link>, or base_url (the address it was fetched from). Returns (feed_title, feed_link, entries),
+    where entries may be empty, or None when the document turns out not to be
+    plain RSS/Atom XML, so the caller can use feedparser.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    stack = []
+    feed_title = feed_link = ''
+    entries = []
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    if not stack and _split_tag(elem.tag) not in _FEED_ROOTS:
+                        return None
+                    stack.append(elem)
+                    continue
+                
+                stack.pop()
+                ns, name = _split_tag(elem.tag)
+                if ns not in _CORE_NS or not stack:
+                    continue
+                parent = stack[-1]
+                
+                if name in ('item', 'entry'):
+                    entries.append(_entry_from_element(elem, feed_link or base_url))
+                    parent.remove(elem)
+                    if len(entries) >= limit:
+                        return feed_title, feed_link, entries
+                elif _split_tag(parent.tag)[1] in ('channel', 'feed'):
+                    # Feed-level metadata (skips <image><title> and friends)
+                    if name == 'title' and not feed_title:
+                        feed_title = (elem.text or '').strip()
+                    elif name == 'link' and not feed_link:
+                        feed_link = _link_href(elem)
+                        if feed_link and base_url:
+                            feed_link = urljoin(base_url, feed_link)
+        parser.close()
+    except ET.ParseError:
+        return None
+    
+    return feed_title, feed_link, entries
+
+def entries_from_feedparser(feed, limit):
+    """Convert the first `limit` feedparser entries into plain article dicts."""
+    entries = []
+    for entry in feed.entries[:limit]:  # Top N per feed
+        g = entry.get
+        content_list = g('content')
+        content = content_list[0].get('value', '') if content_list else ''
+        
+        # Extract image from various RSS formats:
+        # media:content, media:thumbnail, then image enclosures (podcasts/media)
+        image_url = None
+        media = g('media_content') or g('media_thumbnail')
+        if media:
+            image_url = media[0].get('url')
+        else:
+            for enc in g('enclosures') or ():
+                if enc.get('type', '').startswith('image/'):
+                    image_url = enc.get('href')
+                    break
+        
+        # Try looking in content/description for img tags
+        if not image_url:
+            img_match = _IMG_RE.search(content if content_list else g('description', ''))
+            if img_match:
+                image_url = img_match.group(1)
+        
+        # We manually copy fields to avoid serialization issues with struct_time
+        entries.append({
+            'title': g('title', 'No title'),
+            'link': g('link', ''),
+            'summary': g('summary', ''),
+            'content': content,
+            'published': g('published') or g('updated') or '',
+            'updated': g('updated', ''),
+            'id': g('id', ''),
+            'image_url': image_url
+        })
+    return entries
+
+def load_cached_articles(cache_entry, articles_per_feed):
+    """
+    Return the articles saved for a cache entry, or None if the sidecar is gone
+    or was written with a different articles_per_feed limit.
+    """
+    cache_entry = cache_entry or {}
+    if cache_entry.get('articles_per_feed') != articles_per_feed:
+        return None
+    path = cache_entry.get('cached_path')
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    except Exception:
+        return None
+
+def iter_body(response, hasher):
+    """Yield the decoded body of a streamed response, feeding each chunk to hasher."""
+    for chunk in response.iter_content(chunk_size=BODY_CHUNK_SIZE):
+        hasher.update(chunk)
+        yield chunk
+
+def read_head(body, size):
+    """Pull chunks from the body iterator until at least `size` bytes are buffered."""
+    head = []
+    length = 0
+    for chunk in body:
+        head.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            break
+    return b''.join(head)
+
+def http_headers(response):
+    """requests headers as the lower-cased dict feedparser expects for response_headers."""
+    return {k.lower(): v for k, v in response.headers.items()}
+
+def fetch_one(session, url, feed_creds, articles_per_feed, cache_entry=None):
+    """
+    Fetch a single feed and return (articles, cache_entry).
+    
+    cache_entry holds the ETag/Last-Modified validators from the previous run;
+    when the server answers 304 or sends an identical body, the articles saved
+    last time are reused instead of parsing the feed again.
+    """
+    articles = []
+    try:
+        # Check if this feed has credentials
+        feed_config = feed_creds.get(url, {})
+        auth_type = feed_config.get('auth_type')
+        
+        # Prepare headers for authenticated feeds
+        headers = {}
+        if auth_type == 'api_key':
+            headers[feed_config.get('header_name', 'X-API-Key')] = feed_config.get('api_key', '')
+        elif auth_type == 'basic':
+            username = feed_config.get('username', '')
+            password = feed_config.get('password', '')
+            auth_string = base64.b64encode(f'{username}:{password}'.encode()).decode()
+            headers['Authorization'] = f'Basic {auth_string}'
+        elif auth_type == 'bearer':
+            headers['Authorization'] = f'Bearer {feed_config.get("token", "")}'
+        elif auth_type == 'custom_header':
+            headers.update(feed_config.get('headers', {}))
+        
+        # Add default User-Agent to avoid blocking by some sites (like Reddit)
+        if 'User-Agent' not in headers:
+            headers['User-Agent'] = 'python:my-news-digest-bot:v1.0 (by /u/my-news-digest)'
+        
+        # Conditional GET, only if we still have the articles to fall back on
+        cached_articles = load_cached_articles(cache_entry, articles_per_feed)
+        validators = {}
+        if cached_articles is not None:
+            if cache_entry.get('etag'):
+                validators['If-None-Match'] = cache_entry['etag']
+            if cache_entry.get('last_modified'):
+                validators['If-Modified-Since'] = cache_entry['last_modified']
+        
+        # Fetch feed with headers
+        # Use requests for all feeds for consistency and better control.
+        # stream=True lets RSS/Atom bodies be parsed as they arrive (already
+        # gzip/deflate-decoded by iter_content) instead of being held as one
+        # bytes object while several feeds are in flight.
+        try:
+            response = session.get(url, headers=dict(headers, **validators), timeout=10, stream=True)
+            if response.status_code == 304 and cached_articles is not None:
+                response.close()
+                print(f"  - {url}: Not modified, reusing {len(cached_articles)} cached entries")
+                return cached_articles, cache_entry
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f'Error fetching feed {url}: {e}')
+            return [], cache_entry
+        
+        with response:
+            hasher = hashlib.sha256()
+            body = iter_body(response, hasher)
+            head = read_head(body, 4096)
+            
+            # Stream-parse plain RSS/Atom; anything else goes through feedparser
+            parsed = None
+            fast_path = is_plain_feed(head)
+            if fast_path:
+                parsed = parse_feed_fast(itertools.chain([head], body), articles_per_feed, url)
+                # Read whatever the parser didn't need so the hash covers the whole body
+                for _ in body:
+                    pass
+                content = None
+            else:
+                content = head + b''.join(body)
+            body_sha256 = hasher.hexdigest()
+            feed_headers = http_headers(response)
+        
+        if parsed is None and fast_path:
+            # Started as plain RSS/Atom but broke further in (e.g. an HTML
+            # entity mid-document); the streamed body is gone, so fetch it
+            # again in full for feedparser to recover what it can
+            response = session.get(url, headers=headers, timeout=10)
+            response.raise_for_status()
+            content = response.content
+            body_sha256 = hashlib.sha256(content).hexdigest()
+            feed_headers = http_headers(response)
+        
+        # The sidecar holds this feed's articles (with its source_url), so name
+        # it by URL and body; two feeds serving the same bytes don't share one
+        sidecar = hashlib.sha256((url + body_sha256).encode()).hexdigest()
+        new_entry = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'body_sha256': body_sha256,
+            'articles_per_feed': articles_per_feed,
+            'cached_path': os.path.join(FEED_CACHE_DIR, f'{sidecar}.json')
+        }
+        if cached_articles is not None and cache_entry.get('body_sha256') == body_sha256:
+            print(f"  - {url}: Unchanged, reusing {len(cached_articles)} cached entries")
+            return cached_articles, new_entry
+        
+        if parsed is not None:
+            feed_title, feed_link, entries = parsed
+        else:
+            # Hand over the real HTTP headers so feedparser honours the
+            # Content-Type charset and Content-Location for relative links
+            feed = feedparser.parse(content, response_headers=feed_headers)
+            if feed.bozo:
+                print(f"Warning parsing feed {url}: {feed.bozo_exception}")
+            feed_title = feed.feed.get('title', '')
+            feed_link = feed.feed.get('link', '')
+            entries = entries_from_feedparser(feed, articles_per_feed)
+        
+        if not feed_title:
+            # Fallback to domain
+            host = urlparse(url).netloc
+            if host.startswith('www.'):
+                host = host[4:]
+            feed_title = host or 'Unknown Source'
+        
+        # Every article of this feed shares the same two source strings
+        feed_title = sys.intern(feed_title)
+        source_url = sys.intern(feed_link or url)
+
+        # Process entries
+        print(f"  - {feed_title}: Found {len(entries)} entries")
+        
+        for entry in entries:
+            # Add source info to each article
+            article = dict(entry, source_title=feed_title, source_url=source_url)
+            
+            # If published is missing, try updated
+            if not article['published'] and article['updated']:
+                article['published'] = article['updated']
+
+            articles.append(article)
+        
+        with open(new_entry['cached_path'], 'wb') as f:
+            f.write(orjson.dumps(articles))
+    except Exception as e:
+        print(f'Error fetching feed {url}: {e}')
+        return [], cache_entry
+
+    return articles, new_entry
 
 def main():
     # Load feed credentials if file exists
@@ -55,108 +461,47 @@ def main():
     urls = [line.strip() for line in open('feed.txt').readlines() if line.strip()]
     articles = []
     
-    print(f"Fetching {len(urls)} feeds...")
-
-    for url in urls:
+    # Load HTTP validators and parsed-article sidecars from the previous run
+    feed_cache = {}
+    if os.path.exists(FEED_CACHE_FILE):
         try:
-            # Check if this feed has credentials
-            feed_config = feed_creds.get(url, {})
-            auth_type = feed_config.get('auth_type')
-            
-            # Prepare headers for authenticated feeds
-            headers = {}
-            if auth_type == 'api_key':
-                headers[feed_config.get('header_name', 'X-API-Key')] = feed_config.get('api_key', '')
-            elif auth_type == 'basic':
-                username = feed_config.get('username', '')
-                password = feed_config.get('password', '')
-                auth_string = base64.b64encode(f'{username}:{password}'.encode()).decode()
-                headers['Authorization'] = f'Basic {auth_string}'
-            elif auth_type == 'bearer':
-                headers['Authorization'] = f'Bearer {feed_config.get("token", "")}'
-            elif auth_type == 'custom_header':
-                headers.update(feed_config.get('headers', {}))
-            
-            # Add default User-Agent to avoid blocking by some sites (like Reddit)
-            if 'User-Agent' not in headers:
-                headers['User-Agent'] = 'python:my-news-digest-bot:v1.0 (by /u/my-news-digest)'
-            
-            # Fetch feed with headers
-            # Use requests for all feeds for consistency and better control
-            try:
-                response = requests.get(url, headers=headers, timeout=10)
-                response.raise_for_status()
-                feed = feedparser.parse(response.content)
-            except requests.RequestException as e:
-                print(f'Error fetching feed {url}: {e}')
-                continue
-            
-            if feed.bozo:
-                print(f"Warning parsing feed {url}: {feed.bozo_exception}")
-            
-            feed_title = feed.feed.get('title', '')
-            if not feed_title:
-                # Fallback to domain
-                match = re.search(r'https?://([^/]+)', url)
-                feed_title = match.group(1).replace('www.', '') if match else 'Unknown Source'
-
-            # Process entries
-            print(f"  - {feed_title}: Found {len(feed.entries)} entries")
-            
-            for entry in feed.entries[:articles_per_feed]:  # Top N per feed
-                # Extract image from various RSS formats
-                image_url = None
-                
-                # Try media:content (common in RSS)
-                if hasattr(entry, 'media_content') and entry.media_content:
-                    image_url = entry.media_content[0].get('url')
-                
-                # Try media:thumbnail
-                elif hasattr(entry, 'media_thumbnail') and entry.media_thumbnail:
-                    image_url = entry.media_thumbnail[0].get('url')
-                
-                # Try enclosure (podcasts/media)
-                elif hasattr(entry, 'enclosures') and entry.enclosures:
-                    for enc in entry.enclosures:
-                        if enc.get('type', '').startswith('image/'):
-                            image_url = enc.get('href')
-                            break
-                
-                # Try looking in content/description for img tags
-                if not image_url:
-                    content = entry.get('content', [{}])[0].get('value', '') if hasattr(entry, 'content') else entry.get('description', '')
-                    img_match = re.search(r'<img[^>]+src=[\"\']([^\"\'>]+)[\"\']', content)
-                    if img_match:
-                        image_url = img_match.group(1)
-                
-                # Create article dict with image and source info
-                # We manually copy fields to avoid serialization issues with struct_time
-                article = {
-                    'title': entry.get('title', 'No title'),
-                    'link': entry.get('link', ''),
-                    'summary': entry.get('summary', ''),
-                    'content': entry.get('content', [{'value': ''}])[0]['value'] if 'content' in entry else '',
-                    'published': entry.get('published', ''),
-                    'updated': entry.get('updated', ''),
-                    'id': entry.get('id', ''),
-                    'image_url': image_url,
-                    'source_title': feed_title,
-                    'source_url': feed.feed.get('link', url)
-                }
-                
-                # If published is missing, try updated
-                if not article['published'] and article['updated']:
-                    article['published'] = article['updated']
-
-                articles.append(article)
+            with open(FEED_CACHE_FILE, 'rb') as f:
+                feed_cache = orjson.loads(f.read())
         except Exception as e:
-            print(f'Error fetching feed {url}: {e}')
-            continue
+            print(f"Warning: Could not parse {FEED_CACHE_FILE}: {e}")
+    os.makedirs(FEED_CACHE_DIR, exist_ok=True)
+    
+    print(f"Fetching {len(urls)} feeds...")
+
+    workers = config.get('limits', {}).get('fetch_workers', 8)
+    # One pooled session so feeds on the same host reuse TCP/TLS connections
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() keeps results in feed.txt order; articles and feed_cache are only touched here
+        results = executor.map(lambda u: fetch_one(session, u, feed_creds, articles_per_feed, feed_cache.get(u)), urls)
+        new_cache = {}
+        for url, (feed_articles, cache_entry) in zip(urls, results):
+            articles.extend(feed_articles)
+            if cache_entry:
+                new_cache[url] = cache_entry
+    
+    # Persist the cache and drop sidecars no feed points at any more
+    with open(FEED_CACHE_FILE, 'wb') as f:
+        f.write(orjson.dumps(new_cache, option=orjson.OPT_INDENT_2))
+    live_paths = {os.path.normpath(e['cached_path']) for e in new_cache.values()}
+    for name in os.listdir(FEED_CACHE_DIR):
+        path = os.path.normpath(os.path.join(FEED_CACHE_DIR, name))
+        # Only touch sidecar files; leave anything else in the directory alone
+        if name.endswith('.json') and os.path.isfile(path) and path not in live_paths:
+            os.remove(path)
     
     # Save to file
     print(f"Saved {len(articles)} articles to articles.json")
-    with open('articles.json', 'w') as f:
-        json.dump(articles, f, indent=2)
+    with open('articles.json', 'wb') as f:
+        f.write(orjson.dumps(articles, option=orjson.OPT_INDENT_2))
 
 if __name__ == "__main__":
     main()
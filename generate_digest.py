@@ -1,14 +1,30 @@
+import functools
+import hashlib
 import json
+import orjson
 import os
 import re
+import sys
 import html
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from string import Template
+from urllib.parse import urlparse
 import dateutil.parser
 from openai import OpenAI
 
+@functools.lru_cache(maxsize=1024)
 def format_date(date_str):
     if not date_str:
         return ""
+    # ISO 8601 / RFC 3339 dates don't need dateutil's tokenizer
+    if len(date_str) >= 10 and date_str[4] == '-' and date_str[7] == '-':
+        try:
+            dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+            return dt.strftime('%b %d, %H:%M')
+        except ValueError:
+            pass
     try:
         # Try to parse date string using dateutil (handles most formats)
         dt = dateutil.parser.parse(date_str)
@@ -16,16 +32,35 @@ def format_date(date_str):
     except:
         return date_str
 
+SEEN_FILE = 'seen.json'
+# Hosts that serve nothing but GitHub Trending feeds (GitHubTrendingRSS)
+GITHUB_TRENDING_HOSTS = {'mshibanami.github.io'}
+SEEN_CACHE_SIZE = 5000
+# Output token budget per story, and deepseek-reasoner's output limit per request
+TOKENS_PER_GROUP = 4000
+MODEL_MAX_TOKENS = 64000
+MAX_BATCH_SIZE = MODEL_MAX_TOKENS // TOKENS_PER_GROUP
+# Returned by the summarizers when the model judged a story IRRELEVANT
+# (None means the call failed and the story should be retried)
+IRRELEVANT = 'IRRELEVANT'
+
+BATCH_INSTRUCTIONS = """
+
+The text above contains {count} separate stories, numbered "=== Story N ===". Evaluate each story independently.
+Instead of the output format described earlier, reply with ONLY a JSON array containing one object per story:
+[{{"index": N, "relevant": true or false, "score": 0-100, "summary": "summary paragraph without the Sources list"}}]
+Use "relevant": false for stories you would otherwise answer with IRRELEVANT."""
+
+_MARKER_RE = re.compile(r'\{\{(\w+)\}\}')
+_NORM_RE = re.compile(r'[^a-z0-9\s]')
+_ARTICLE_TMPL = '<div class="article">{image}<h4>{title}</h4><p class="meta">{meta}</p><p>{summary}</p></div>'
+
 def normalize_title(t):
-    t = t.lower()
-    t = re.sub(r'[^a-z0-9\s]', '', t)
+    t = _NORM_RE.sub('', t.lower())
     words = set(t.split())
     return words
 
-def are_similar(title1, title2):
-    words1 = normalize_title(title1)
-    words2 = normalize_title(title2)
-    
+def are_similar_sets(words1, words2):
     if not words1 or not words2:
         return False
     
@@ -35,23 +70,61 @@ def are_similar(title1, title2):
     
     return similarity > 0.6 and intersection >= 3
 
+def similarity_prefixes(norm_sets):
+    """
+    Prefix filter for are_similar_sets: each set's rarest words.
+    
+    With words ordered by how many titles use them, two sets with Jaccard
+    similarity above 0.6 must share a word within the first
+    len(s) - ceil(0.6 * len(s)) + 1 words of each, so indexing only those
+    finds every match while common words like "the" index almost nothing.
+    """
+    freq = {}
+    for words in norm_sets:
+        for w in words:
+            freq[w] = freq.get(w, 0) + 1
+    prefixes = []
+    for words in norm_sets:
+        ordered = sorted(words, key=lambda w: (freq[w], w))
+        # ceil(0.6 * n) in integer arithmetic, avoiding float rounding
+        prefixes.append(ordered[:len(ordered) - (3 * len(ordered) + 4) // 5 + 1])
+    return prefixes
+
+def is_github_trending(item):
+    """Check if an article comes from the GitHub Trending feed."""
+    try:
+        source = urlparse(item.get('source_url', ''))
+    except ValueError:
+        # Malformed feed URL, e.g. an unclosed IPv6 bracket
+        return False
+    host = source.netloc.lower()
+    if host in GITHUB_TRENDING_HOSTS:
+        return True
+    if host == 'github.com' and source.path.startswith('/trending'):
+        return True
+    return item.get('source_title', '').lower().startswith('github trending')
+
 def get_source_name(item):
     if item.get('source_title') and item.get('source_title') != 'Unknown Source':
             return item['source_title']
     # Fallback to domain extraction
-    url = item.get('url', '')
-    match = re.search(r'https?://([^/]+)', url)
-    return match.group(1).replace('www.', '') if match else 'Unknown'
+    try:
+        host = urlparse(item.get('url', '')).netloc
+    except ValueError:
+        # Malformed URL, e.g. an unclosed IPv6 bracket
+        return 'Unknown'
+    if host.startswith('www.'):
+        host = host[4:]
+    return host or 'Unknown'
+
+def format_group_articles(group):
+    articles_list = []
+    for a in group:
+        articles_list.append(f"Article title: {a['title']}\nArticle URL: {a['link']}\nContent/Snippet: {a.get('summary', '')[:500]}")
+    return "\n\n".join(articles_list)
 
 def summarize_group(client, group, system_prompt, prompt_template, topics_str):
-    if len(group) == 1:
-        a = group[0]
-        articles_text = f"Article title: {a['title']}\nArticle URL: {a['link']}\nContent/Snippet: {a.get('summary', '')[:500]}"
-    else:
-        articles_list = []
-        for a in group:
-            articles_list.append(f"Article title: {a['title']}\nArticle URL: {a['link']}\nContent/Snippet: {a.get('summary', '')[:500]}")
-        articles_text = "\n\n".join(articles_list)
+    articles_text = format_group_articles(group)
     
     user_message = prompt_template.format(articles=articles_text, topics=topics_str)
     
@@ -62,12 +135,12 @@ def summarize_group(client, group, system_prompt, prompt_template, topics_str):
                 {'role':'system','content':system_prompt},
                 {'role':'user','content':user_message}
             ],
-            max_tokens=4000
+            max_tokens=TOKENS_PER_GROUP
         )
         ai_response = resp.choices[0].message.content.strip()
         
         if ai_response.upper().startswith('IRRELEVANT'):
-            return None
+            return IRRELEVANT
 
         score = 0
         summary_text = ai_response
@@ -87,23 +160,186 @@ def summarize_group(client, group, system_prompt, prompt_template, topics_str):
         else:
             summary_only = summary_text
         
-        urls = [a['link'] for a in group]
-        
-        return {
-            'title': group[0]['title'],
-            'url': urls[0],
-            'urls': urls,
-            'summary': summary_only,
-            'image_url': group[0].get('image_url'),
-            'score': score,
-            'source_title': group[0].get('source_title', 'Unknown Source'),
-            'source_url': group[0].get('source_url', urls[0]),
-            'published': group[0].get('published', '')
-        }
+        return group_result(group, summary_only, score)
     except Exception as e:
         print(f"Error summarizing group: {e}")
         return None
 
+def summarize_groups_batch(client, groups, system_prompt, prompt_template, topics_str):
+    """
+    Summarize several story groups with a single model call.
+    
+    Returns a list aligned with groups holding the summary dict, IRRELEVANT,
+    or None where the reply could not be attributed (so the caller can retry
+    that group on its own).
+    """
+    stories = []
+    for n, group in enumerate(groups, 1):
+        stories.append(f"=== Story {n} ===\n{format_group_articles(group)}")
+    
+    user_message = prompt_template.format(articles="\n\n".join(stories), topics=topics_str)
+    user_message += BATCH_INSTRUCTIONS.format(count=len(groups))
+    
+    try:
+        resp = client.chat.completions.create(
+            model='deepseek-reasoner',
+            messages=[
+                {'role':'system','content':system_prompt},
+                {'role':'user','content':user_message}
+            ],
+            max_tokens=min(TOKENS_PER_GROUP * len(groups), MODEL_MAX_TOKENS)
+        )
+        ai_response = resp.choices[0].message.content.strip()
+        # Tolerate a ```json fence or prose around the array
+        items = orjson.loads(ai_response[ai_response.index('['):ai_response.rindex(']') + 1])
+    except Exception as e:
+        print(f"Error summarizing batch of {len(groups)} groups: {e}")
+        return [None] * len(groups)
+    
+    results = [None] * len(groups)
+    for item in items:
+        try:
+            i = int(item['index']) - 1
+            if not 0 <= i < len(groups):
+                continue
+            if not item.get('relevant', True):
+                results[i] = IRRELEVANT
+                continue
+            summary = str(item['summary']).split('Sources:')[0].strip()
+            results[i] = group_result(groups[i], summary, int(item.get('score', 0)))
+        except Exception:
+            continue
+    return results
+
+def group_result(group, summary, score):
+    urls = [a['link'] for a in group]
+    
+    return {
+        'title': group[0]['title'],
+        'url': urls[0],
+        'urls': urls,
+        'summary': summary,
+        'image_url': group[0].get('image_url'),
+        'score': score,
+        'source_title': group[0].get('source_title', 'Unknown Source'),
+        'source_url': group[0].get('source_url', urls[0]),
+        'published': group[0].get('published', '')
+    }
+
+def article_key(a):
+    """Key for an article in seen.json: its feed id, or its link when the feed has no guid."""
+    return a.get('id') or a.get('link')
+
+def load_seen():
+    """Load verdicts and summaries of previously processed articles, keyed by article_key."""
+    if not os.path.exists(SEEN_FILE):
+        return {}
+    try:
+        with open(SEEN_FILE, 'rb') as f:
+            return orjson.loads(f.read())
+    except Exception as e:
+        print(f"Warning: Could not parse {SEEN_FILE}: {e}")
+        return {}
+
+def save_seen(seen):
+    # Keep only the most recently used entries
+    recent = sorted(seen.items(), key=lambda kv: kv[1].get('seen_at', 0), reverse=True)
+    with open(SEEN_FILE, 'wb') as f:
+        f.write(orjson.dumps(dict(recent[:SEEN_CACHE_SIZE])))
+
+def prompt_hash(system_prompt, prompt_template, topics_str):
+    """Fingerprint of the prompts a verdict was made with, so editing them invalidates seen.json."""
+    return hashlib.sha256('\0'.join([system_prompt, prompt_template, topics_str]).encode()).hexdigest()
+
+def cached_group_result(seen, group, phash):
+    """
+    Reuse the verdict from seen.json if every article in the group was processed before
+    with the same prompts.
+    
+    Returns the rebuilt summary dict, IRRELEVANT, or None when the group needs the model.
+    """
+    keys = [article_key(a) for a in group]
+    if not all(key and key in seen and seen[key].get('prompt_hash') == phash for key in keys):
+        return None
+    now = time.time()
+    for key in keys:
+        seen[key]['seen_at'] = now
+    cached = seen[keys[0]]
+    if cached.get('relevant') is False:
+        return IRRELEVANT
+    return group_result(group, cached['summary'], cached['score'])
+
+def remember_group(seen, group, res, phash):
+    now = time.time()
+    for a in group:
+        key = article_key(a)
+        if not key:
+            continue
+        entry = {
+            'relevant': res is not IRRELEVANT,
+            'title': a['title'],
+            'url': a['link'],
+            'published': a.get('published', ''),
+            'prompt_hash': phash,
+            'seen_at': now
+        }
+        if res is not IRRELEVANT:
+            entry['summary'] = res['summary']
+            entry['score'] = res['score']
+        seen[key] = entry
+
+def summarize_groups(client, groups, seen, workers, batch_size, system_prompt, prompt_template, topics_str):
+    """
+    Summarize groups concurrently, reusing cached summaries from seen.json
+    that were made with the same prompts.
+    
+    Uncached groups are sent batch_size at a time in one model call each.
+    Returns the relevant results in group order and records them in seen.
+    """
+    phash = prompt_hash(system_prompt, prompt_template, topics_str)
+    results = [cached_group_result(seen, group, phash) for group in groups]
+    pending = [i for i, res in enumerate(results) if res is None]
+    batches = [pending[k:k + batch_size] for k in range(0, len(pending), batch_size)]
+    
+    def run_batch(batch):
+        batch_groups = [groups[i] for i in batch]
+        if len(batch_groups) == 1:
+            return [summarize_group(client, batch_groups[0], system_prompt, prompt_template, topics_str)]
+        batch_results = summarize_groups_batch(client, batch_groups, system_prompt, prompt_template, topics_str)
+        # Fall back to one call per group for anything the batch reply missed
+        return [summarize_group(client, g, system_prompt, prompt_template, topics_str) if res is None else res
+                for g, res in zip(batch_groups, batch_results)]
+    
+    # The model calls are network-bound, so a small thread pool overlaps them
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch, batch_results in zip(batches, executor.map(run_batch, batches)):
+            for i, res in zip(batch, batch_results):
+                results[i] = res
+    
+    relevant = []
+    for group, res in zip(groups, results):
+        if res is None:
+            # The call failed; leave it out of seen.json so the next run retries
+            continue
+        remember_group(seen, group, res, phash)
+        if res is not IRRELEVANT:
+            relevant.append(res)
+    return relevant
+
+def load_html_template(raw):
+    """
+    Turn email_template.html into a string.Template.
+    
+    The {{#ARTICLES}}...{{/ARTICLES}} example block becomes ${ARTICLES_BLOCK}
+    and every {{KEY}} marker becomes ${KEY}, so all values go in with one scan.
+    """
+    prefix, marker, rest = raw.partition('{{#ARTICLES}}')
+    if marker:
+        _, _, suffix = rest.partition('{{/ARTICLES}}')
+        raw = prefix + '{{ARTICLES_BLOCK}}' + suffix
+    # Escape literal $ first so only our markers are placeholders
+    return Template(_MARKER_RE.sub(r'${\1}', raw.replace('$', '$$')))
+
 def render_article_html(item, show_image=True):
     safe_summary = html.escape(item['summary'])
     safe_title = html.escape(item['title'])
@@ -123,13 +359,7 @@ def render_article_html(item, show_image=True):
     if published_date:
         meta_html += f' • {published_date}'
 
-    article_template = '<div class="article">{{IMAGE}}<h4>{{TITLE}}</h4><p class="meta">{{META}}</p><p>{{SUMMARY}}</p></div>'
-    
-    article_html = article_template.replace('{{IMAGE}}', img_html)
-    article_html = article_html.replace('{{TITLE}}', title_html)
-    article_html = article_html.replace('{{SUMMARY}}', safe_summary)
-    article_html = article_html.replace('{{META}}', meta_html)
-    return article_html
+    return _ARTICLE_TMPL.format(image=img_html, title=title_html, meta=meta_html, summary=safe_summary)
 
 def main():
     # Load config
@@ -142,11 +372,20 @@ def main():
         print("Error: articles.json not found. Run fetch_feeds.py first.")
         return
 
-    with open('articles.json') as f:
-        articles = json.load(f)
+    with open('articles.json', 'rb') as f:
+        articles = orjson.loads(f.read())
+    
+    # orjson creates a new string per occurrence; share one copy per feed
+    for a in articles:
+        for key in ('source_title', 'source_url'):
+            if isinstance(a.get(key), str):
+                a[key] = sys.intern(a[key])
     
     MY_TOPICS = config.get('topics', ['AI', 'Technology', 'Startup'])
     final_digest_count = config.get('limits', {}).get('final_digest_count', 10)
+    llm_workers = config.get('limits', {}).get('llm_workers', 6)
+    # Larger batches would ask for more output tokens than the model allows
+    llm_batch_size = min(max(1, config.get('limits', {}).get('llm_batch_size', 5)), MAX_BATCH_SIZE)
     topics_str = ', '.join(MY_TOPICS)
     
     # Load prompts
@@ -176,46 +415,53 @@ def main():
     regular_articles = []
     
     for a in articles:
-        # Check if it's from GitHub Trending feed
-        src = a.get('source_url', '').lower()
-        title = a.get('source_title', '').lower()
-        if 'githubtrendingrss' in src or 'github trending' in title:
+        if is_github_trending(a):
             github_articles.append(a)
         else:
             regular_articles.append(a)
             
     print(f"Separated {len(github_articles)} GitHub articles and {len(regular_articles)} regular articles.")
+    
+    seen = load_seen()
+    new_articles = [a for a in articles if article_key(a) not in seen]
+    print(f"{len(new_articles)} articles have not been processed before.")
 
     # --- Process Regular Articles ---
     processed_indices = set()
     article_groups = []
-    
+
+    # Normalize each title once and index articles by their rarest title
+    # words, so only plausible matches are compared instead of every pair
+    norm_sets = [normalize_title(a['title']) for a in regular_articles]
+    prefixes = similarity_prefixes(norm_sets)
+    word_index = {}
+    for i, prefix in enumerate(prefixes):
+        for w in prefix:
+            word_index.setdefault(w, []).append(i)
+
     for i, a in enumerate(regular_articles):
         if i in processed_indices: continue
-        
+
         # Pre-filter removed to let AI determine relevance
-        
+
         group = [a]
         processed_indices.add(i)
-        
-        for j, other in enumerate(regular_articles[i+1:], start=i+1):
+
+        words1 = norm_sets[i]
+        candidates = {j for w in prefixes[i] for j in word_index[w] if j > i}
+        for j in sorted(candidates):
             if j in processed_indices: continue
             # Check similarity for grouping
-            if are_similar(a['title'], other['title']):
-                group.append(other)
+            if are_similar_sets(words1, norm_sets[j]):
+                group.append(regular_articles[j])
                 processed_indices.add(j)
-        
+
         article_groups.append(group)
     
     print(f"Summarizing {len(article_groups)} regular story groups...")
     
     system_prompt_regular = raw_system_prompt.format(topics=topics_str)
-    filtered_regular = []
-    
-    for group in article_groups:
-        res = summarize_group(client, group, system_prompt_regular, prompt_template, topics_str)
-        if res:
-            filtered_regular.append(res)
+    filtered_regular = summarize_groups(client, article_groups, seen, llm_workers, llm_batch_size, system_prompt_regular, prompt_template, topics_str)
             
     filtered_regular.sort(key=lambda x: x.get('score', 0), reverse=True)
     
@@ -233,15 +479,14 @@ def main():
     else:
          system_prompt_github = raw_system_prompt.format(topics=github_topics)
     
-    filtered_github = []
-    for a in github_articles:
-        # Treat each as a group of 1
-        res = summarize_group(client, [a], system_prompt_github, prompt_template, github_topics)
-        if res:
-            filtered_github.append(res)
+    # Treat each as a group of 1
+    github_groups = [[a] for a in github_articles]
+    filtered_github = summarize_groups(client, github_groups, seen, llm_workers, llm_batch_size, system_prompt_github, prompt_template, github_topics)
             
     # Sort GitHub by score (or keep feed order if score is similar)
     filtered_github.sort(key=lambda x: x.get('score', 0), reverse=True)
+    
+    save_seen(seen)
 
     # --- Generate Output ---
     
@@ -252,23 +497,25 @@ def main():
     html_filename = f'digests/{timestamp}.html'
     
     # Markdown
+    md_parts = ['# Your Daily Digest\n\n']
+    
+    if filtered_regular:
+        md_parts.append('## Top Stories\n\n')
+        for item in filtered_regular[:final_digest_count]:
+            md_parts.append(f'### {item["title"]}\n{item["summary"]}\n{item["url"]}\n\n')
+    
+    if filtered_github:
+        md_parts.append('## Trending GitHub Repos\n\n')
+        for item in filtered_github:
+            md_parts.append(f'### {item["title"]}\n{item["summary"]}\n{item["url"]}\n\n')
+    
     with open(md_filename, 'w') as f:
-        f.write('# Your Daily Digest\n\n')
-        
-        if filtered_regular:
-            f.write('## Top Stories\n\n')
-            for item in filtered_regular[:final_digest_count]:
-                f.write(f'### {item["title"]}\n{item["summary"]}\n{item["url"]}\n\n')
-        
-        if filtered_github:
-            f.write('## Trending GitHub Repos\n\n')
-            for item in filtered_github:
-                f.write(f'### {item["title"]}\n{item["summary"]}\n{item["url"]}\n\n')
+        f.write(''.join(md_parts))
 
     # HTML
     if os.path.exists('email_template.html'):
         with open('email_template.html', 'r') as f:
-            html_template = f.read()
+            html_template = load_html_template(f.read())
     else:
         print("Error: email_template.html not found")
         return
@@ -287,32 +534,28 @@ def main():
         hero_image_html = f'<img src="{hero["image_url"]}" alt="{safe_hero_alt}">'
 
     # Build Regular Articles HTML
-    articles_html = ''
-    for item in filtered_regular[1:final_digest_count]:
-        articles_html += render_article_html(item, show_image=True)
+    articles_html = ''.join(render_article_html(item, show_image=True) for item in filtered_regular[1:final_digest_count])
         
     # Build GitHub HTML
     github_html = ''
     if filtered_github:
-        github_html = '<div class="more"><h3>Trending GitHub Repositories</h3>'
-        for item in filtered_github:
-             github_html += render_article_html(item, show_image=False)
-        github_html += '</div><div class="divider"></div>'
+        github_parts = ['<div class="more"><h3>Trending GitHub Repositories</h3>']
+        github_parts.extend(render_article_html(item, show_image=False) for item in filtered_github)
+        github_parts.append('</div><div class="divider"></div>')
+        github_html = ''.join(github_parts)
     
-    # Replace in template
+    # Fill the template in a single pass
     date_str = datetime.utcnow().strftime('%A, %B %d, %Y')
-    html_content = html_template.replace('{{DATE}}', date_str)
-    html_content = html_content.replace('{{HERO_TITLE}}', html.escape(hero['title']))
-    html_content = html_content.replace('{{HERO_SOURCE}}', hero_source_html)
-    html_content = html_content.replace('{{HERO_IMAGE}}', hero_image_html)
-    html_content = html_content.replace('{{HERO_SUMMARY}}', html.escape(hero['summary']))
-    html_content = html_content.replace('{{HERO_URL}}', hero['url'])
-    
-    # Inject GitHub Section
-    html_content = html_content.replace('{{GITHUB_SECTION}}', github_html)
-    
-    # Inject Regular Articles
-    html_content = re.sub(r'\{\{#ARTICLES\}\}.*?\{\{/ARTICLES\}\}', articles_html, html_content, flags=re.DOTALL)
+    html_content = html_template.safe_substitute(
+        DATE=date_str,
+        HERO_TITLE=html.escape(hero['title']),
+        HERO_SOURCE=hero_source_html,
+        HERO_IMAGE=hero_image_html,
+        HERO_SUMMARY=html.escape(hero['summary']),
+        HERO_URL=hero['url'],
+        GITHUB_SECTION=github_html,
+        ARTICLES_BLOCK=articles_html
+    )
     
     with open(html_filename, 'w') as f:
         f.write(html_content)
@@ -10,6 +10,7 @@ import os
 import base64
 import sys
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 
@@ -72,7 +73,7 @@ def test_feed(url, feed_creds):
         try:
             response = requests.get(url, headers=headers, timeout=10)
             response.raise_for_status()
-            feed = feedparser.parse(response.content)
+            feed = feedparser.parse(response.content, response_headers={k.lower(): v for k, v in response.headers.items()})
         except requests.RequestException as e:
             result['status'] = 'error'
             result['error'] = f'Request failed: {e}'
@@ -140,12 +141,12 @@ def main():
     if feed_creds:
         print(f"Loaded credentials for {len(feed_creds)} feed(s)\n")
     
-    # Test each feed
-    results = []
-    for i, url in enumerate(urls, 1):
-        print(f"[{i}/{len(urls)}] Testing: {url}")
-        result = test_feed(url, feed_creds)
-        results.append(result)
+    # Test feeds concurrently, then report in feed.txt order
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda u: test_feed(u, feed_creds), urls))
+    
+    for i, result in enumerate(results, 1):
+        print(f"[{i}/{len(urls)}] Testing: {result['url']}")
         
         if result['status'] == 'success':
             auth_info = " (with auth)" if result['has_auth'] else ""